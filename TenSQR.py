@@ -2,12 +2,14 @@
 
 import argparse
 import math
-import random
+import multiprocessing
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import scipy as sp
+from scipy.special import gammaln
 from scipy.stats import binom
 
 
@@ -21,15 +23,441 @@ def ACGT_count(M_E):
     Returns:
         (n_SNVs, 4) array containing the count of each A, C, G and T in each SNV.
     """
+    if M_E.ndim != 2:
+        raise ValueError("arr should be 2D")
+    # compare-and-sum keeps each pass over the (usually int8) reads one byte wide, where
+    # an offset bincount would widen every element to intp; read counts fit in int32
+    return np.stack(
+        [(M_E == k).sum(axis=0, dtype=np.int32) for k in range(1, 5)], axis=1
+    )
+
+
+def grouped_ACGT_count(M_E, groups, n_groups):
+    """
+    ACGT statistics of each group of reads in a read matrix.
+
+    Args:
+        M_E: (n_reads, n_SNVs) array
+        groups: (n_reads,) array containing the group, in [0, n_groups), of each read
+        n_groups: number of groups
+
+    Returns:
+        (n_groups, n_SNVs, 4) array containing the count of each A, C, G and T in each
+        SNV, for the reads of each group.
+    """
     if M_E.ndim != 2:
         raise ValueError("arr should be 2D")
     n_snvs = M_E.shape[1]
-    out = np.zeros((n_snvs, 4))
-    for i in range(4):
-        out[:, i] = (M_E == (i + 1)).sum(axis=0)
+    # offset each column and group into its own block of 5 bins (gap, A, C, G, T) so a
+    # single bincount tallies every SNV of every group in one pass
+    bins = (M_E + 5 * np.arange(n_snvs) + 5 * n_snvs * groups[:, None]).ravel()
+    counts = np.bincount(bins, minlength=5 * n_snvs * n_groups)
+    return counts.reshape(n_groups, n_snvs, 5)[:, :, 1:]
+
+
+def identical_count(M_E, V):
+    """
+    Number of identical nucleotides between each read and each haplotype.
+
+    Args:
+        M_E: (n_reads, n_SNVs) read matrix
+        V: (n_haplotypes, n_SNVs) haplotypes
+
+    Returns:
+        (n_reads, n_haplotypes) array.
+    """
+    out = np.empty((len(M_E), len(V)), dtype=int)
+    # compare reads in chunks to bound the (chunk, n_haplotypes, n_SNVs) temporary
+    chunk = max(1, 2**24 // max(V.size, 1))
+    for start in range(0, len(M_E), chunk):
+        reads = M_E[start : start + chunk]
+        out[start : start + chunk] = (reads[:, None, :] == V[None, :, :]).sum(axis=2)
     return out
 
 
+def rsvd(A, k, n_iter=2, n_oversamples=10):
+    """
+    Truncated SVD of a dense matrix using a randomized range finder.
+
+    The range of A is sampled with a Gaussian test matrix, refined with power
+    iterations (LU-normalized between passes) and orthonormalized with a Householder
+    QR, which stays stable when A has a lower rank than the sample. The SVD of the
+    projected matrix B = Q^T A comes from a small eigendecomposition of B B^T, or from
+    a gesdd of B when its top k eigenvalues are too ill-conditioned to take roots of.
+    A dense LAPACK gesdd of A is only used when the sample would not be smaller than A.
+
+    Args:
+        A: (m, n) array
+        k: number of singular values / vectors to return
+        n_iter: number of power iterations
+        n_oversamples: extra columns sampled beyond k to improve accuracy
+
+    Returns:
+        U (m, k), S (k,) and Vt (k, n), with singular values in descending order.
+    """
+    n_samples = k + n_oversamples
+    if n_samples >= min(A.shape):
+        U, S, Vt = sp.linalg.svd(A, full_matrices=False, lapack_driver="gesdd")
+        return U[:, :k], S[:k], Vt[:k]
+    Y = A @ np.random.standard_normal((A.shape[1], n_samples)).astype(A.dtype)
+    for _ in range(n_iter):
+        Y = sp.linalg.lu(Y, permute_l=True)[0]
+        Y = A @ (A.T @ Y)
+    Q = sp.linalg.qr(Y, mode="economic")[0]
+    B = Q.T @ A
+    eigvals, W = np.linalg.eigh(B @ B.T)
+    eigvals, W = eigvals[::-1][:k], W[:, ::-1][:, :k]
+    if eigvals[-1] > np.finfo(eigvals.dtype).eps * eigvals[0]:
+        S = np.sqrt(eigvals)
+        return Q @ W, S, (W.T @ B) / S[:, None]
+    W, S, Vt = sp.linalg.svd(B, full_matrices=False, lapack_driver="gesdd")
+    return Q @ W[:, :k], S[:k], Vt[:k]
+
+
+def random_argmax(counts):
+    """
+    Argmax along the last axis, breaking ties uniformly at random.
+
+    Args:
+        counts: array of integer counts
+
+    Returns:
+        Array of indices of the maximum along the last axis of counts.
+    """
+    # jitter in [0, 1) cannot reorder distinct integer counts, only tied ones
+    return np.argmax(counts + np.random.random(counts.shape), axis=-1)
+
+
+def alt_min(TM_E, P_matrix, M_E, Vt, ACGTcount, max_ite, error_thre):
+    """
+    Alternating minimization of a read matrix into R haplotypes.
+
+    Args:
+        TM_E: (n_reads, 4 * n_SNVs) read matrix in tensor structure
+        P_matrix: (n_reads, n_SNVs) projection matrix
+        M_E: (n_reads, n_SNVs) read matrix
+        Vt: (R, 4 * n_SNVs) initial real-valued haplotypes
+        ACGTcount: (n_SNVs, 4) ACGT statistics of M_E, used for positions that none of
+            the reads assigned to a haplotype cover
+        max_ite: maximum number of iterations
+        error_thre: stopping criteria
+
+    Returns:
+        U, (n_reads, R) array assigning each read to a haplotype, and Vt, (R, 4 * n_SNVs)
+        array of haplotypes in tensor structure.
+    """
+    hap_len = M_E.shape[1]
+    R = len(Vt)
+    BV = np.eye(R, dtype=TM_E.dtype)  # Basic vectors of dimension R
+    ite = 0  # iteration count
+    err = np.inf  # current Frobenius norm
+    err_Com = np.inf  # difference between current and previous Frobenius norm
+    err_hap = (
+        np.inf
+    )  # Frobenius norm of the difference between current and previous haplotypes
+    err_hist = np.zeros((1, max_ite))  # record current Frobenius norm
+    Vt_last = 100 * np.ones(
+        (R, 4 * hap_len)
+    )  # initialization for haplotypes of last iteration
+    # ||(TM_E - Vt[i, :]) * P_tensor||^2 is expanded into GEMMs below, where P_tensor
+    # is P_matrix repeated for each of the 4 nucleotide blocks of TM_E and Vt. TM_E is
+    # one-hot and zero at gaps, so TM_E * P_tensor == TM_E, and products with P_tensor
+    # reduce to products of P_matrix with Vt**2 summed over the nucleotide blocks
+    TM_sq = TM_E.sum(axis=1)  # squared norm of each read
+    TM_sq_total = TM_sq.sum(dtype=np.float64)  # squared Frobenius norm of TM_E
+
+    # alternating minimization
+    while (
+        err_hap > error_thre
+        and err > error_thre
+        and err_Com > error_thre
+        and ite < max_ite
+    ):
+        ite += 1
+        # update U matrix
+        U = (
+            TM_sq[:, None]
+            - 2 * np.dot(TM_E, Vt.T)
+            + np.dot(P_matrix, (Vt**2).reshape(R, 4, hap_len).sum(axis=1).T)
+        )  # distance between each read and each haplotype
+        min_index = np.argmin(U, axis=1)
+        U = BV[min_index.astype(int), :]
+        # update V matrix
+        V_major = np.zeros((R, hap_len))  # majority voting result
+        for i in range(R):
+            reads_single = M_E[min_index == i, :]  # all reads from one haplotypes
+            single_sta = np.zeros((hap_len, 4))
+            if len(reads_single) != 0:
+                single_sta = ACGT_count(
+                    reads_single
+                )  # ACGT statistics of a single nucleotide position
+            V_major[i, :] = np.argmax(single_sta, axis=1) + 1
+            uncov_pos = np.where(np.sum(single_sta, axis=1) == 0)[0]
+            # if not covered, select the most dominant one based on 'ACGTcount'
+            V_major[i, uncov_pos] = random_argmax(ACGTcount[uncov_pos, :]) + 1
+        Vt = np.concatenate(
+            (
+                (V_major == 1).astype(TM_E.dtype),
+                (V_major == 2).astype(TM_E.dtype),
+                (V_major == 3).astype(TM_E.dtype),
+                (V_major == 4).astype(TM_E.dtype),
+            ),
+            axis=1,
+        )
+
+        # termination criteria
+        # ||(TM_E - U Vt) * P_tensor||^2 = ||TM_E||^2 - 2 <TM_E, U Vt> + <P_tensor, (U Vt)^2>
+        # where U is binary, so both inner products reduce to small GEMMs with U^T
+        err = np.sqrt(
+            max(
+                TM_sq_total
+                - 2 * np.sum(np.dot(U.T, TM_E) * Vt, dtype=np.float64)
+                + np.sum(
+                    np.dot(U.T, P_matrix) * (Vt**2).reshape(R, 4, hap_len).sum(axis=1),
+                    dtype=np.float64,
+                ),
+                0,
+            )
+        )
+        err_hist[0, ite - 1] = err
+        if ite > 1:
+            err_Com = abs(err_hist[0, ite - 1] - err_hist[0, ite - 2])
+        D = Vt - Vt_last  # change in haplotypes
+        err_hap = np.sqrt(np.einsum("ij,ij->", D, D)) / np.sqrt(4 * hap_len / R)
+        Vt_last = Vt.copy()
+        print(
+            "ite: "
+            + str(ite)
+            + "; err: "
+            + str(err)
+            + "; err_Com: "
+            + str(err_Com)
+            + "; err_hap: "
+            + str(err_hap)
+            + "; R: "
+            + str(R)
+        )
+    return U, Vt
+
+
+def assign_reads(M_E, V_flag, ACGTcount, mis_cri, seq_err):
+    """
+    Reads to assign to a haplotype.
+
+    A read is assigned if it has no mismatches with the haplotype or, if its hamming
+    distance is within its criteria of mismatches, if sequencing error explains the
+    mismatches better than the read being a variant given the ACGT statistics.
+
+    Args:
+        M_E: (n_reads, n_SNVs) read matrix
+        V_flag: (n_SNVs,) haplotype
+        ACGTcount: (n_SNVs, 4) ACGT statistics of M_E
+        mis_cri: (n_reads,) criteria of mismatches for each read
+        seq_err: sequencing error rate
+
+    Returns:
+        Array of the indices of the reads to assign.
+    """
+    nongap = M_E != 0
+    n_nongap = nongap.sum(axis=1)  # number of nongap positions
+    hd = ((M_E != V_flag) & nongap).sum(axis=1)  # hamming distance
+    accept = hd == 0
+    cand = np.flatnonzero((hd != 0) & (hd <= mis_cri))
+    if len(cand) != 0:
+        M_cand = M_E[cand, :]
+        freq = ACGTcount / np.maximum(
+            ACGTcount.sum(axis=1, keepdims=True), 1
+        )  # nucleotide frequencies at each position
+        gathered = freq[
+            np.arange(M_E.shape[1]), np.clip(M_cand - 1, 0, 3)
+        ]  # frequency of each read's nucleotide
+        log_variant = np.log(np.where(nongap[cand], gathered, 1)).sum(
+            axis=1
+        )  # log variant probability of each read
+        k, l = hd[cand], n_nongap[cand]
+        log_seq = (
+            gammaln(l + 1)
+            - gammaln(k + 1)
+            - gammaln(l - k + 1)
+            + k * np.log(seq_err)
+            + (l - k) * np.log1p(-seq_err)
+        )  # log binomial probability of the mismatches being sequencing errors
+        accept[cand] = log_seq > log_variant
+    return np.flatnonzero(accept)
+
+
+def successive_clustering(
+    SNVmatrix,
+    ori_TM_E,
+    ori_P_matrix,
+    ori_mis_cri,
+    ori_ACGTcount,
+    K,
+    svd_flag,
+    seq_err,
+    max_ite,
+    error_thre,
+    seed=None,
+):
+    """
+    Successive clustering of a read matrix into at most K haplotypes.
+
+    Haplotypes are reconstructed from the most to the least abundant. In each round the
+    remaining reads are clustered by alternating minimization, initialized from their
+    truncated SVD, and the reads of the most dominant haplotype are removed.
+
+    Args:
+        SNVmatrix: (n_reads, n_SNVs) read matrix
+        ori_TM_E: (n_reads, 4 * n_SNVs) read matrix in tensor structure
+        ori_P_matrix: (n_reads, n_SNVs) projection matrix
+        ori_mis_cri: (n_reads,) criteria of mismatches for each read
+        ori_ACGTcount: (n_SNVs, 4) ACGT statistics of SNVmatrix
+        K: number of haplotypes to start from
+        svd_flag: 1 for plus sign, 2 for minus sign of the SVD initialization
+        seq_err: sequencing error rate
+        max_ite: maximum iteration number for alternating minimization
+        error_thre: stopping criteria for alternating minimization
+        seed: if given, seeds numpy's global random state, so that worker processes
+            don't share a random stream
+
+    Returns:
+        None if alternating minimization does not work. Otherwise the MEC of the
+        reconstructed haplotypes and the (n_haplotypes, n_SNVs) haplotypes themselves.
+    """
+    if seed is not None:
+        np.random.seed(seed)
+    print("K_ite = " + str(K))
+    print("svd_flag = " + str(svd_flag))
+    R = K
+    hap_len = SNVmatrix.shape[1]
+    # rows are only ever dropped with boolean indexing, which returns new arrays, so
+    # the original matrices can be shared without copying
+    M_E = SNVmatrix  # read matrix
+    TM_E = ori_TM_E  # read matrix in tensor structure
+    P_matrix = ori_P_matrix  # projection matrix
+    mis_cri = ori_mis_cri  # criteria of mismatches for each read
+    ACGTcount = ori_ACGTcount.copy()  # updated ACGT statistics
+    num_V = 1
+    reconV = np.zeros((R, hap_len), dtype=int)  # reconstructed haplotypes
+    # successive clustering
+    while R != 0 and M_E.shape[0] > R:
+        print("R = " + str(R))
+        num_read = M_E.shape[0]  # updated number of read
+        Ut, S, Vt = rsvd(TM_E, R)  # truncated svd
+        Vt = np.dot(np.diag(np.sqrt(S)), Vt)  # initial real-valued haplotypes
+        if svd_flag == 2:
+            Vt = -Vt
+        # alternating minimization
+        U, Vt = alt_min(TM_E, P_matrix, M_E, Vt, ACGTcount, max_ite, error_thre)
+
+        V = np.argmax(Vt.reshape(R, hap_len, 4, order="F"), axis=2) + 1
+
+        # assign reads to the most dominant haplotype
+        domi_flag = np.argmax(U.sum(axis=0))  # the index of the most dominant haplotype
+        V_flag = V[domi_flag, :]
+        index = assign_reads(
+            M_E, V_flag, ACGTcount, mis_cri, seq_err
+        )  # indices for reads to be assigned to the most dominant haplotype
+
+        # decide whether to stop current successive clustering
+        if len(index) == 0:
+            return None
+
+        # aditional majority voting
+        addi_count = ACGT_count(
+            M_E[index, :]
+        )  # ACGT statistics for additional majority voting
+        V[domi_flag, :] = (np.argmax(addi_count, axis=1) + 1) * np.double(
+            np.sum(addi_count, axis=1) != 0
+        ) + V_flag * np.double(np.sum(addi_count, axis=1) == 0)
+
+        # remove assigned reads
+        reconV[num_V - 1, :] = V[domi_flag, :]  # record the most dominant haplotype
+        ACGTcount -= addi_count  # update the ACGT statistics
+        keep = np.ones(num_read, dtype=bool)  # reads left unassigned
+        keep[index] = False
+        mis_cri = mis_cri[keep]  # remove corresponding 'mis_cri'
+        M_E = M_E[keep]  # remove reads
+        num_read = M_E.shape[0]  # update the number of reads
+        TM_E = TM_E[keep]  # update the read matrix in tensor structure
+        P_matrix = P_matrix[keep]  # updated projection matrix
+        num_V += 1
+        R -= 1
+
+    # one more majority voting after getting all the haplptypes
+    iden_table = identical_count(
+        SNVmatrix, reconV[: num_V - 1]
+    )  # table of number of identical nucleotides
+    index = np.argmax(iden_table, axis=1)  # indices for all the reads
+    hap_sta = grouped_ACGT_count(
+        SNVmatrix, index, num_V - 1
+    )  # ACGT statistics of the reads of each haplotype
+    reconV2 = (
+        np.argmax(hap_sta, axis=2) + 1
+    )  # new haplotypes after one more majority voting
+    uncov_hap, uncov_pos = np.nonzero(hap_sta.sum(axis=2) == 0)
+    # if not covered, select the most dominant one based on 'ACGTcount'
+    reconV2[uncov_hap, uncov_pos] = random_argmax(ori_ACGTcount[uncov_pos, :]) + 1
+
+    # MEC for reconV2
+    iden_table = identical_count(
+        SNVmatrix, reconV2
+    )  # table of number of identical nucleotides
+    true_ind = np.argmax(iden_table, axis=1)  # final indices of reads
+    M = reconV2[true_ind, :]  # Completed read matrix
+    MEC = int(((SNVmatrix != M) & (SNVmatrix != 0)).sum())  # mismatches at nongaps
+    return MEC, reconV2
+
+
+_worker_args = ()  # successive clustering arguments shared by every task of a worker
+
+
+def init_clustering_worker(*args):
+    """
+    Store the arguments of successive_clustering that are shared by every K and sign.
+
+    Used as the initializer of the worker processes, so the read matrices are handed
+    to each worker once (and inherited without pickling when workers are forked)
+    instead of being pickled with every submitted task.
+
+    Args:
+        *args: SNVmatrix, ori_TM_E, ori_P_matrix, ori_mis_cri, ori_ACGTcount, seq_err,
+            max_ite and error_thre, as passed to successive_clustering
+    """
+    global _worker_args
+    _worker_args = args
+
+
+def clustering_task(K, svd_flag, seed):
+    """
+    Successive clustering of the read matrix stored by init_clustering_worker.
+
+    Args:
+        K: number of haplotypes to start from
+        svd_flag: 1 for plus sign, 2 for minus sign of the SVD initialization
+        seed: seed of the worker's random state
+
+    Returns:
+        The result of successive_clustering.
+    """
+    SNVmatrix, TM_E, P_matrix, mis_cri, ACGTcount, seq_err, max_ite, error_thre = (
+        _worker_args
+    )
+    return successive_clustering(
+        SNVmatrix,
+        TM_E,
+        P_matrix,
+        mis_cri,
+        ACGTcount,
+        K,
+        svd_flag,
+        seq_err,
+        max_ite,
+        error_thre,
+        seed,
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("TenSQR.py")
     parser.add_argument(
@@ -78,8 +506,8 @@ if __name__ == "__main__":
     lowQSseqname = zone_name + "_lowQSseq.txt"  # low quality score sequence name
     Homoseqname = zone_name + "_Homo_seq.txt"  # homo sequence name
 
-    # import SNV matrix
-    SNVmatrix = np.loadtxt(SNVmatrixname, ndmin=2).astype(int)
+    # import SNV matrix (0 for gaps, 1-4 for A, C, G, T)
+    SNVmatrix = np.loadtxt(SNVmatrixname, ndmin=2, dtype=np.int8)
 
     if len(SNVmatrix) == 0:
         print(
@@ -101,34 +529,34 @@ if __name__ == "__main__":
     tStart = time.time()  # starting time
 
     # threshold for read assignment of the most dominant haplotype based on p-value
-    num_read, hap_len = SNVmatrix.shape  # number of reads, length of haplotypes
-    P_matrix = np.double(SNVmatrix != 0)  # projection matrix
-    P_tensor = np.tile(P_matrix, (1, 4))  # projection matrix of tensor structure
+    P_matrix = (SNVmatrix != 0).astype(np.float32)  # projection matrix
+    ori_TM_E = np.concatenate(
+        (
+            (SNVmatrix == 1).astype(np.float32),
+            (SNVmatrix == 2).astype(np.float32),
+            (SNVmatrix == 3).astype(np.float32),
+            (SNVmatrix == 4).astype(np.float32),
+        ),
+        axis=1,
+    )  # original read matrix in tensor structure
+    ori_P_matrix = P_matrix  # original projection matrix
     nongap = P_matrix.sum(axis=1)  # number of nongap positions of each read
     max_thre = 20  # maximum mismatches for a read and a haplotype # 7 300
     max_len = 300  # maximum number of nongap positions
     L = []  # threshold for number of nongap positions
     Th = []  # corresponding maximum number of mismatches
+    Ls = np.arange(1, max_len + 1)  # candidate numbers of nongap positions
     for thre in range(1, max_thre + 1):
-        for l in range(1, max_len + 1):
-            pr = 1
-            for k in range(thre):
-                pr -= binom.pmf(k, l, seq_err)
-            if pr >= p_value:
-                Th.append(thre)
-                L.append(l)
-                break
+        pr = 1 - binom.cdf(thre - 1, Ls, seq_err)  # P(at least 'thre' errors)
+        hit = np.flatnonzero(pr >= p_value)
+        if len(hit) != 0:
+            Th.append(thre)
+            L.append(int(Ls[hit[0]]))
     L[0] += 1
-    mis_cri = np.zeros((num_read), dtype=int)  # criteria of mismatches for each read
-    for i in range(num_read):
-        for l in range(len(Th)):
-            if nongap[i] < L[l]:
-                mis_cri[i] = l + 1
-                break
-        if mis_cri[i] == 0:
-            mis_cri[i] = len(Th) + 1
+    # criteria of mismatches for each read: one more than the index of the first
+    # threshold exceeding its number of nongap positions (len(Th) + 1 if none does)
+    mis_cri = np.searchsorted(L, nongap, side="right") + 1
     ori_mis_cri = mis_cri.copy()  # original criteria of mismatches for each read
-    ori_num_read = num_read  # original number of reads
 
     # rank estimation+successive clustering+alternating minimization parameter setting
     error_thre = 10**-5  # stopping criteria for alternating minimization
@@ -139,338 +567,60 @@ if __name__ == "__main__":
     MEC_table = np.zeros(
         (5, 50)
     )  # table to record K(set length to 50), returned number of haplotypes, recall, MEC and MEC rate
+    reconVK = {}  # reconstructed haplotypes for each K
 
     # rank estimation
+    pool = ProcessPoolExecutor(
+        max_workers=2,
+        mp_context=(
+            multiprocessing.get_context("fork") if sys.platform == "linux" else None
+        ),
+        initializer=init_clustering_worker,
+        initargs=(
+            SNVmatrix,
+            ori_TM_E,
+            ori_P_matrix,
+            ori_mis_cri,
+            ori_ACGTcount,
+            seq_err,
+            max_ite,
+            error_thre,
+        ),
+    )  # workers for the two signs of successive clustering
     while K_table[1] - K_table[0] != 1:  # stopping criteria for rank estimation
         K = int(K)
         for K_ite in range(
             K, K + 2
         ):  # search 2 continuous K values to calculate MEC rate
             if len(np.where(MEC_table[0, :] == K_ite)[0]) == 0:
-                alt_tag1 = 1
-                # indicator for plus sign alternating minimization
-                alt_tag2 = 1
-                # indicator for minus sign alternating minimization
+                # successive clustering for the plus and minus signs of the svd
+                futures = [
+                    pool.submit(
+                        clustering_task,
+                        K_ite,
+                        svd_flag,  # 1 for plus sign; 2 for minus sign
+                        np.random.randint(2**31),
+                    )
+                    for svd_flag in range(1, 3)
+                ]
+                results = [future.result() for future in futures]
+                ori_K = K_ite  # original K value
+                alt_tag1 = int(
+                    results[0] is not None
+                )  # indicator for plus sign alternating minimization
+                alt_tag2 = int(
+                    results[1] is not None
+                )  # indicator for minus sign alternating minimization
                 MEC = np.array(
                     [np.inf, np.inf]
                 )  # MEC to record alternating minimization with different signs
                 recall = np.zeros(2)  # record recall rate
                 hap_num = np.zeros(2)  # number of haplotypes reconstructed
-                for svd_flag in range(1, 3):  # 1 for plus sign; 2 for minus sign
-                    print("K_ite = " + str(K_ite))
-                    print("svd_flag = " + str(svd_flag))
-                    R = K_ite
-                    M_E = SNVmatrix.copy()  # read matrix
-                    TM_E = np.concatenate(
-                        (
-                            np.double(M_E == 1),
-                            np.double(M_E == 2),
-                            np.double(M_E == 3),
-                            np.double(M_E == 4),
-                        ),
-                        axis=1,
-                    )  # read matrix in tensor structure
-                    mis_cri = ori_mis_cri.copy()  # criteria of mismatches for each read
-                    ori_K = R  # original K value
-                    num_V = 1
-                    reconV = np.zeros(
-                        (R, hap_len), dtype=int
-                    )  # reconstructed haplotypes
-                    # successive clustering
-                    while R != 0 and len(M_E[:, 0]) > R:
-                        print("R = " + str(R))
-                        P_matrix = np.double(M_E != 0)  # updated projection matrix
-                        P_tensor = np.tile(
-                            P_matrix, (1, 4)
-                        )  # updated projection matrix of tensor structure
-                        num_read = len(M_E[:, 0])  # updated number of read
-                        Ut, S, Vt = sp.sparse.linalg.svds(TM_E, R)  # svd
-                        Vt = np.dot(
-                            np.diag(np.sqrt(S)), Vt
-                        )  # initial real-valued haplotypes
-                        Vt = Vt[::-1]
-                        if svd_flag == 2:
-                            Vt = -Vt
-                        ACGTcount = ACGT_count(M_E)  # updated ACGT statistics
-                        BV = np.eye(R, dtype=int)  # Basic vectors of dimension R
-                        ite = 0  # iteration count
-                        err = np.inf  # current Frobenius norm
-                        err_Com = (
-                            np.inf
-                        )  # difference between current and previous Frobenius norm
-                        err_hap = (
-                            np.inf
-                        )  # Frobenius norm of the difference between current and previous haplotypes
-                        err_hist = np.zeros(
-                            (1, max_ite)
-                        )  # record current Frobenius norm
-                        Vt_last = 100 * np.ones(
-                            (R, 4 * hap_len)
-                        )  # initialization for haplotypes of last iteration
-
-                        # alternating minimization
-                        while (
-                            err_hap > error_thre
-                            and err > error_thre
-                            and err_Com > error_thre
-                            and ite < max_ite
-                        ):
-                            ite += 1
-                            # update U matrix
-                            U = np.zeros((num_read, R))
-                            for i in range(R):
-                                U[:, i] = np.sum(
-                                    ((TM_E - Vt[i, :]) * P_tensor) ** 2, axis=1
-                                )
-                            min_index = np.argmin(U, axis=1)
-                            U = BV[min_index.astype(int), :]
-                            # update V matrix
-                            V_major = np.zeros((R, hap_len))  # majority voting result
-                            for i in range(R):
-                                reads_single = M_E[
-                                    min_index == i, :
-                                ]  # all reads from one haplotypes
-                                single_sta = np.zeros((hap_len, 4))
-                                if len(reads_single) != 0:
-                                    single_sta = ACGT_count(
-                                        reads_single
-                                    )  # ACGT statistics of a single nucleotide position
-                                V_major[i, :] = np.argmax(single_sta, axis=1) + 1
-                                uncov_pos = np.where(np.sum(single_sta, axis=1) == 0)[0]
-                                for j in range(len(uncov_pos)):
-                                    if (
-                                        len(
-                                            np.where(
-                                                ACGTcount[uncov_pos[j], :]
-                                                == max(ACGTcount[uncov_pos[j], :])
-                                            )[0]
-                                        )
-                                        != 1
-                                    ):  # if not covered, select the most doninant one based on 'ACGTcount'
-                                        tem = np.where(
-                                            ACGTcount[uncov_pos[j], :]
-                                            == max(ACGTcount[uncov_pos[j], :])
-                                        )[0]
-                                        V_major[i, uncov_pos[j]] = (
-                                            tem[
-                                                int(
-                                                    np.floor(random.random() * len(tem))
-                                                )
-                                            ]
-                                            + 1
-                                        )
-                                    else:
-                                        V_major[i, uncov_pos[j]] = (
-                                            np.argmax(ACGTcount[uncov_pos[j], :]) + 1
-                                        )
-                            Vt = np.concatenate(
-                                (
-                                    np.double(V_major == 1),
-                                    np.double(V_major == 2),
-                                    np.double(V_major == 3),
-                                    np.double(V_major == 4),
-                                ),
-                                axis=1,
-                            )
-
-                            # termination criteria
-                            err = np.linalg.norm(
-                                (TM_E - np.dot(U, Vt)) * P_tensor, ord="fro"
-                            )
-                            err_hist[0, ite - 1] = err
-                            if ite > 1:
-                                err_Com = abs(
-                                    err_hist[0, ite - 1] - err_hist[0, ite - 2]
-                                )
-                            err_hap = np.linalg.norm(Vt - Vt_last, ord="fro") / np.sqrt(
-                                4 * hap_len / R
-                            )
-                            Vt_last = Vt.copy()
-                            print(
-                                "ite: "
-                                + str(ite)
-                                + "; err: "
-                                + str(err)
-                                + "; err_Com: "
-                                + str(err_Com)
-                                + "; err_hap: "
-                                + str(err_hap)
-                                + "; R: "
-                                + str(R)
-                            )
-
-                        V = np.argmax(Vt.reshape(R, hap_len, 4, order="F"), axis=2) + 1
-
-                        # assign reads to the most dominant haplotype
-                        domi_flag = np.argmax(
-                            U.sum(axis=0)
-                        )  # the index of the most dominant haplotype
-                        V_flag = V[domi_flag, :]
-                        HD_table = np.zeros(
-                            (num_read, 3)
-                        )  # a table to record 'number of identical nucleotides', 'number of nongap positions' and 'hamming distance'
-                        index = (
-                            []
-                        )  # indices for reads to be assigned to the most dominant haplotype
-                        num_mem = 0  # count the number of assigned reads
-                        HD_table[:, 0] = ((M_E - V[domi_flag, :]) == 0).sum(
-                            axis=1
-                        )  # number of identical nucleotides
-                        HD_table[:, 1] = (M_E != 0).sum(
-                            axis=1
-                        )  # number of nongap positions
-                        HD_table[:, 2] = (
-                            HD_table[:, 1] - HD_table[:, 0]
-                        )  # hamming distance
-
-                        for i in range(num_read):
-                            if (
-                                HD_table[i, 2] == 0
-                            ):  # assign the read if hamming distance is 0
-                                num_mem += 1
-                                index.append(i)
-                            elif (
-                                HD_table[i, 2] <= mis_cri[i]
-                            ):  # if hamming distance is not 0, assign the read based on probability distributions
-                                pos = np.where(M_E[i, :] != 0)[
-                                    0
-                                ]  # the position of nongaps
-                                pr_variant = (
-                                    1  # initial variant probability of the read
-                                )
-                                for j in range(len(pos)):
-                                    pr_variant *= ACGTcount[
-                                        pos[j], M_E[i, pos[j]] - 1
-                                    ] / sum(ACGTcount[pos[j], :])
-                                pr_seq = binom.pmf(
-                                    HD_table[i, 2], HD_table[i, 1], seq_err
-                                )  # sequencing error of the read
-                                if pr_seq > pr_variant:
-                                    num_mem += 1
-                                    index.append(i)
-
-                        # decide whether to stop current successive clustering
-                        if len(index) == 0:
-                            if svd_flag == 1:
-                                alt_tag1 = 0
-                                break
-                            else:
-                                alt_tag2 = 0
-                                break
-
-                        # aditional majority voting
-                        index = np.array(index)
-                        addi_count = ACGT_count(
-                            M_E[index, :]
-                        )  # ACGT statistics for additional majority voting
-                        V[domi_flag, :] = (
-                            np.argmax(addi_count, axis=1) + 1
-                        ) * np.double(
-                            np.sum(addi_count, axis=1) != 0
-                        ) + V_flag * np.double(
-                            np.sum(addi_count, axis=1) == 0
-                        )
-
-                        # remove assigned reads
-                        reconV[num_V - 1, :] = V[
-                            domi_flag, :
-                        ]  # record the most dominant haplotype
-                        mis_cri = np.delete(
-                            mis_cri, index, 0
-                        )  # remove corresponding 'mis_cri'
-                        M_E = np.delete(M_E, index, 0)  # remove reads
-                        num_read = len(M_E[:, 0])  # update the number of reads
-                        TM_E = np.concatenate(
-                            (
-                                np.double(M_E == 1),
-                                np.double(M_E == 2),
-                                np.double(M_E == 3),
-                                np.double(M_E == 4),
-                            ),
-                            axis=1,
-                        )  # update the read matrix in tensor structure
-                        P_matrix = np.double(M_E != 0)  # updated projection matrix
-                        P_tensor = np.tile(
-                            P_matrix, (1, 4)
-                        )  # updated projection matrix of tensor structure
-                        num_V += 1
-                        R -= 1
-
-                    if (alt_tag1 == 1 and svd_flag == 1) or (
-                        alt_tag2 == 1 and svd_flag == 2
-                    ):
-                        # one more majority voting after getting all the haplptypes
-                        index = np.zeros(ori_num_read)  # indices for all the reads
-                        # table of number of identical nucleotides
-                        iden_table = np.zeros((ori_num_read, num_V - 1))
-                        for i in range(num_V - 1):
-                            iden_table[:, i] = (SNVmatrix - reconV[i, :] == 0).sum(
-                                axis=1
-                            )  # number of identical nucleotides for each read compared with the (i+1)th haplotype
-                        index = np.argmax(iden_table, axis=1)
-                        reconV2 = np.zeros(
-                            (num_V - 1, hap_len)
-                        )  # new haplotypes after one more majority voting
-                        for i in range(num_V - 1):
-                            reads_single = SNVmatrix[
-                                index == i, :
-                            ]  # all reads from one haplotypes
-                            single_sta = np.zeros((hap_len, 4))
-                            if len(reads_single) != 0:
-                                single_sta = ACGT_count(
-                                    reads_single
-                                )  # ACGT statistics of a single nucleotide position
-                            reconV2[i, :] = np.argmax(single_sta, axis=1) + 1
-                            uncov_pos = np.where(np.sum(single_sta, axis=1) == 0)[0]
-                            for j in range(len(uncov_pos)):
-                                if (
-                                    len(
-                                        np.where(
-                                            ori_ACGTcount[uncov_pos[j], :]
-                                            == max(ori_ACGTcount[uncov_pos[j], :])
-                                        )[0]
-                                    )
-                                    != 1
-                                ):  # if not covered, select the most doninant one based on 'ACGTcount'
-                                    tem = np.where(
-                                        ori_ACGTcount[uncov_pos[j], :]
-                                        == max(ori_ACGTcount[uncov_pos[j], :])
-                                    )[0]
-                                    reconV2[i, uncov_pos[j]] = (
-                                        tem[int(np.floor(random.random() * len(tem)))]
-                                        + 1
-                                    )
-                                else:
-                                    reconV2[i, uncov_pos[j]] = (
-                                        np.argmax(ori_ACGTcount[uncov_pos[j], :]) + 1
-                                    )
-
-                                    # MEC for reconV2
-                        num_read = ori_num_read
-                        true_ind = np.zeros(num_read)  # final indices of reads
-                        iden_table = np.zeros(
-                            (num_read, len(reconV2[:, 0]))
-                        )  # table of number of identical nucleotides
-                        for i in range(len(reconV2[:, 0])):
-                            iden_table[:, i] = (SNVmatrix - reconV2[i, :] == 0).sum(
-                                axis=1
-                            )  # number of identical nucleotides for each read compared with the (i+1)th haplotype
-                        true_ind = np.argmax(iden_table, axis=1)
-                        M = reconV2[true_ind, :]  # Completed read matrix
-                        P_matrix = SNVmatrix.copy()
-                        P_matrix[P_matrix != 0] = 1  # projection matrix
-                        MEC[svd_flag - 1] = len(
-                            np.where((SNVmatrix - M) * P_matrix != 0)[0]
-                        )
-                        hap_num[svd_flag - 1] = len(
-                            reconV2[:, 0]
-                        )  # number of haplotypes returned
-
-                        # record reconV2
-                        if svd_flag == 1:
-                            reconV3 = reconV2.copy()
-                        else:
-                            reconV4 = reconV2.copy()
+                reconV_sign = [None, None]  # reconV2 for each sign
+                for j, result in enumerate(results):
+                    if result is not None:
+                        MEC[j], reconV_sign[j] = result
+                        hap_num[j] = len(reconV_sign[j])
 
                 # break if alternating minimization does not work^M
                 if alt_tag1 == 0 and alt_tag2 == 0:
@@ -490,11 +640,8 @@ if __name__ == "__main__":
                 K_count += 1
 
                 # record reconV2
-                if MEC_index == 0:
-                    reconV5 = reconV3.copy()
-                else:
-                    reconV5 = reconV4.copy()
-                exec("reconVK" + str(K_ite) + " = reconV5")
+                reconV5 = reconV_sign[MEC_index]
+                reconVK[K_ite] = reconV5
             else:
                 MEC_table[:, K_count - 1] = MEC_table[
                     :, np.where(MEC_table[0, :] == K_ite)[0][0]
@@ -524,6 +671,7 @@ if __name__ == "__main__":
             else:
                 K_table[1] = MEC_table[0, K_count - 3]
                 K = np.floor(sum(K_table) / 2)
+    pool.shutdown()
 
     tEnd = time.time()
     i = np.where(MEC_table[0, :] == K_table[1])[0][0]
@@ -534,29 +682,18 @@ if __name__ == "__main__":
     print("CPU time: " + str(tEnd - tStart))
 
     # deletion
-    (m, n) = eval("reconVK" + str(int(MEC_table[0, i])) + ".shape")
-    reconV2 = eval("reconVK" + str(int(MEC_table[0, i])))
-    index = np.zeros(ori_num_read)  # indices for all the reads
-    iden_table = np.zeros((ori_num_read, m))  # table of number of identical nucleotides
-    for i in range(m):
-        iden_table[:, i] = (SNVmatrix - reconV2[i, :] == 0).sum(
-            axis=1
-        )  # number of identical nucleotides for each read compared with the (i+1)th haplotype
-    index = np.argmax(iden_table, axis=1)
-
-    V_deletion = np.zeros((m, n))
-    for i in range(m):
-        reads_single = SNVmatrix[index == i, :]  # all reads from one haplotype
-        single_sta = np.zeros((hap_len, 4))
-        if len(reads_single) != 0:
-            single_sta = ACGT_count(
-                reads_single
-            )  # ACGT statistics of a single nucleotide position
-        V_deletion[i, :] = np.argmax(single_sta, axis=1) + 1
-        uncov_pos = np.where(np.sum(single_sta, axis=1) == 0)[0]
-        if len(uncov_pos) != 0:
-            V_deletion[i, uncov_pos] = 0
-    V_deletion = V_deletion.astype(int)
+    reconV2 = reconVK[int(MEC_table[0, i])]
+    m = len(reconV2)
+    iden_table = identical_count(
+        SNVmatrix, reconV2
+    )  # table of number of identical nucleotides
+    index = np.argmax(iden_table, axis=1)  # indices for all the reads
+
+    hap_sta = grouped_ACGT_count(
+        SNVmatrix, index, m
+    )  # ACGT statistics of the reads of each haplotype
+    V_deletion = np.argmax(hap_sta, axis=2) + 1
+    V_deletion[hap_sta.sum(axis=2) == 0] = 0  # uncovered positions are deletions
     fre_count = []
 
     for i in range(m):
@@ -581,35 +718,15 @@ if __name__ == "__main__":
     # homosequence
     Homoseq = np.loadtxt(Homoseqname)
     Homoseq = Homoseq.astype(int)
-    Glen = len(Homoseq)
     K = m
 
     # full sequence
-    Recon_Quasi = []
-    for _ in range(K):
-        Recon_Quasi.append(list(Homoseq))
-    Recon_Quasi = np.array(Recon_Quasi)
-    for i in range(Recon_Quasi.shape[0]):
-        Recon_Quasi[i, SNVpos] = V_deletion_new[i, :]
+    Recon_Quasi = np.tile(Homoseq, (K, 1))
+    Recon_Quasi[:, SNVpos] = V_deletion_new
 
     # output
-    Quasi = []
-    for i in range(len(Recon_Quasi)):
-        seq = ""
-        for j in range(len(Recon_Quasi[i, :])):
-            if j + 1 > Glen and Recon_Quasi[i, j] == 0:
-                break
-            if Recon_Quasi[i, j] == 1:
-                seq += "A"
-            elif Recon_Quasi[i, j] == 2:
-                seq += "C"
-            elif Recon_Quasi[i, j] == 3:
-                seq += "G"
-            elif Recon_Quasi[i, j] == 4:
-                seq += "T"
-            elif Recon_Quasi[i, j] == 0:
-                seq += "*"
-        Quasi.append(seq)
+    base_lut = np.frombuffer(b"*ACGT", dtype="S1")  # deletion, A, C, G, T
+    Quasi = [base_lut[seq].tobytes().decode() for seq in Recon_Quasi]
 
     viralseq_fre = viralseq_fre_new
     Hashtable = dict()
@@ -1,64 +1,276 @@
 #!/usr/bin/env python3
 
 import unittest
+from unittest import mock
+
 import numpy as np
+import scipy as sp
+from scipy.stats import binom
+
+from TenSQR import (
+    ACGT_count,
+    alt_min,
+    assign_reads,
+    grouped_ACGT_count,
+    identical_count,
+    random_argmax,
+    rsvd,
+    successive_clustering,
+)
+
+try:
+    import numba
+
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
 
-from TenSQR import ACGT_count
+_RNG = np.random.default_rng(0)
 
 
-def preexisting_ACGT_count(M_E):
+def onehot_ACGT_count(M_E):
     """
-    This is the ACGT_count implementation that existed previously in the TenSQR repo. Including it
-    here so that I can compare it's output to the new version that handles more cases.
+    Reference ACGT count, computed independently of ACGT_count to cross-check it.
+
+    Each read is expanded into a one-hot row by indexing a basis whose gap row is zero, and
+    the counts are vector-matrix products of ones with those rows. Reads are processed in
+    blocks whose one-hot rows fit in 64 KiB, so each block stays in L2 between being built
+    and being reduced.
     """
-    out = np.zeros((len(M_E[0, :]), 4))
-    for i in range(4):
-        out[:, i] = (M_E == (i + 1)).sum(axis=0)
+    M_E = np.ascontiguousarray(M_E, dtype=np.uint8)
+    basis = np.eye(5, dtype=np.float32)[:, 1:]  # gap, A, C, G, T -> one-hot over A, C, G, T
+    row_bytes = M_E.shape[1] * basis.shape[1] * basis.itemsize
+    block = max(1, 65536 // max(row_bytes, 1))
+    counts = np.zeros(M_E.shape[1] * 4, dtype=np.float32)
+    for r0 in range(0, M_E.shape[0], block):
+        onehot = basis[M_E[r0 : r0 + block]].reshape(-1, M_E.shape[1] * 4)
+        counts += np.ones(len(onehot), dtype=np.float32) @ onehot
+    return counts.reshape(M_E.shape[1], 4).astype(np.int64)
+
+
+def loop_ACGT_count(M_E):
+    """
+    Golden ACGT count: a single pass over every element of the read matrix, incrementing the
+    counter of its SNV and nucleotide. Compiled with numba when it is installed.
+    """
+    out = np.zeros((M_E.shape[1], 4), dtype=np.intp)
+    for r in range(M_E.shape[0]):
+        for c in range(M_E.shape[1]):
+            v = M_E[r, c]
+            if 1 <= v <= 4:
+                out[c, v - 1] += 1
     return out
 
 
+if _NUMBA_AVAILABLE:
+    loop_ACGT_count = numba.njit(cache=True)(loop_ACGT_count)
+
+
 class TestACGTCount(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.arr_9x5 = _RNG.integers(1, 5, size=(9, 5), dtype=np.uint8)
+        cls.arr_1x5 = _RNG.integers(1, 5, size=(1, 5), dtype=np.uint8)
+        cls.arr_9x1 = _RNG.integers(1, 5, size=(9, 1), dtype=np.uint8)
+        cls.arr_1d_9 = _RNG.integers(1, 5, size=9, dtype=np.uint8)
+        cls.arr_9x5_gaps = _RNG.integers(0, 5, size=(9, 5), dtype=np.uint8)
+        cls.arr_300x40_gaps = _RNG.integers(0, 5, size=(300, 40), dtype=np.uint8)
+
     def test_returns_nsnv_by_4_array(self):
         """It should return a n. SNV x 4 array."""
-        n_reads = 9
-        n_snvs = 5
-        arr = np.random.choice([1, 2, 3, 4], n_snvs * n_reads).reshape(n_reads, n_snvs)
-        out = ACGT_count(arr)
-        self.assertEqual(out.shape, (n_snvs, 4))
+        out = ACGT_count(self.arr_9x5)
+        self.assertEqual(out.shape, (5, 4))
 
-    def test_matches_previous_implementation(self):
-        """Test the new version matches the previous implementation."""
-        n_reads = 9
-        n_snvs = 5
-        arr = np.random.choice([1, 2, 3, 4], n_snvs * n_reads).reshape(n_reads, n_snvs)
-        out = ACGT_count(arr)
-        out_old = preexisting_ACGT_count(arr)
+    def test_matches_golden_loop_count(self):
+        """Test the new version matches the single-pass golden count."""
+        out = ACGT_count(self.arr_9x5)
+        out_old = loop_ACGT_count(self.arr_9x5)
         self.assertTrue((out == out_old).all())
 
     def test_single_read_case(self):
         """Should return a [5, 4] array."""
-        n_reads = 1
-        n_snvs = 5
-        arr = np.random.choice([1, 2, 3, 4], n_snvs * n_reads).reshape(n_reads, n_snvs)
-        out = ACGT_count(arr)
+        out = ACGT_count(self.arr_1x5)
         self.assertEqual(out.shape, (5, 4))
 
     def test_single_snv_case_as_2d(self):
         """Should return a [1, 4] array. Here ACGT is passed as a proper 2D array."""
-        n_reads = 9
-        n_snvs = 1
-        arr = np.random.choice([1, 2, 3, 4], n_snvs * n_reads).reshape(n_reads, n_snvs)
-        out = ACGT_count(arr)
+        out = ACGT_count(self.arr_9x1)
         self.assertEqual(out.shape, (1, 4))
 
+    def test_gaps_not_counted(self):
+        """Gaps (0) should not contribute to any of the A, C, G, T counts."""
+        arr = self.arr_9x5_gaps
+        out = ACGT_count(arr)
+        self.assertTrue((out.sum(axis=1) == (arr != 0).sum(axis=0)).all())
+        self.assertTrue((out == onehot_ACGT_count(arr)).all())
+        self.assertTrue((out == loop_ACGT_count(arr)).all())
+
+    def test_matches_across_reference_blocks(self):
+        """Reads spanning several 64 KiB blocks of onehot_ACGT_count should all be counted."""
+        arr = self.arr_300x40_gaps  # blocks of 102 reads
+        out = ACGT_count(arr)
+        self.assertTrue((out == onehot_ACGT_count(arr)).all())
+        self.assertTrue((out == loop_ACGT_count(arr)).all())
+
     def test_passing_1d_array(self):
         """Passing a 1D array should throw a ValueError."""
-        n_reads = 9
-        n_snvs = 1
-        arr = np.random.choice([1, 2, 3, 4], n_snvs * n_reads)
         with self.assertRaises(ValueError):
-            ACGT_count(arr)
+            ACGT_count(self.arr_1d_9)
+
+
+class TestGroupedACGTCount(unittest.TestCase):
+
+    def test_matches_ACGT_count_per_group(self):
+        """Each group's counts should match ACGT_count on that group's reads."""
+        n_reads = 30
+        n_snvs = 5
+        n_groups = 4
+        arr = _RNG.integers(0, 5, size=(n_reads, n_snvs), dtype=np.uint8)
+        groups = _RNG.integers(0, n_groups - 1, size=n_reads)  # last group left empty
+        out = grouped_ACGT_count(arr, groups, n_groups)
+        self.assertEqual(out.shape, (n_groups, n_snvs, 4))
+        for i in range(n_groups):
+            self.assertTrue((out[i] == ACGT_count(arr[groups == i])).all())
+
+
+class TestIdenticalCount(unittest.TestCase):
+
+    def test_matches_per_haplotype_loop(self):
+        """Should count the identical nucleotides of each read with each haplotype."""
+        M_E = _RNG.integers(0, 5, size=(30, 6), dtype=np.uint8)
+        V = _RNG.integers(1, 5, size=(3, 6), dtype=np.uint8)
+        out = identical_count(M_E, V)
+        self.assertEqual(out.shape, (30, 3))
+        for i in range(3):
+            self.assertTrue((out[:, i] == (M_E - V[i, :] == 0).sum(axis=1)).all())
+
+
+class TestRSVD(unittest.TestCase):
+
+    def test_matches_full_svd(self):
+        """Singular values and subspaces should match a full SVD of a low rank matrix."""
+        k = 3
+        A = _RNG.random((200, k)) @ _RNG.random((k, 40))
+        U, S, Vt = rsvd(A, k)
+        S_full = np.linalg.svd(A, compute_uv=False)
+        self.assertTrue(np.allclose(S, S_full[:k]))
+        self.assertTrue(np.allclose(U @ np.diag(S) @ Vt, A))
+
+    def assert_no_full_svd(self, A, k):
+        """Run rsvd(A, k), asserting that A itself is never passed to a dense SVD."""
+        with mock.patch.object(sp.linalg, "svd", wraps=sp.linalg.svd) as svd:
+            out = rsvd(A, k)
+        for call in svd.call_args_list:
+            self.assertNotEqual(call.args[0].shape, A.shape)
+        return out
+
+    def test_randomized_accuracy_on_noisy_low_rank(self):
+        """The randomized path should recover the leading singular triplets."""
+        k = 4
+        A = _RNG.random((300, k)) @ _RNG.random((k, 80)) + 1e-3 * _RNG.random((300, 80))
+        U, S, Vt = self.assert_no_full_svd(A, k)
+        U_full, S_full, Vt_full = np.linalg.svd(A, full_matrices=False)
+        self.assertTrue(np.allclose(S, S_full[:k], rtol=1e-6))
+        self.assertTrue(np.allclose(np.abs(Vt @ Vt_full[:k].T), np.eye(k), atol=1e-4))
+        self.assertTrue(np.allclose(U.T @ U, np.eye(k)))
+
+    def test_rank_below_k_stays_randomized(self):
+        """A matrix of rank below k should be decomposed without a full SVD of it."""
+        A = _RNG.random((400, 2)) @ _RNG.random((2, 100))
+        U, S, Vt = self.assert_no_full_svd(A, 3)
+        S_full = np.linalg.svd(A, compute_uv=False)
+        self.assertTrue(np.allclose(S, S_full[:3]))
+        self.assertTrue(np.allclose(U @ np.diag(S) @ Vt, A))
+
+    def test_returns_descending_singular_values(self):
+        """Singular values should be returned largest first."""
+        A = _RNG.random((100, 30))
+        U, S, Vt = rsvd(A, 5)
+        self.assertEqual(U.shape, (100, 5))
+        self.assertEqual(Vt.shape, (5, 30))
+        self.assertTrue((np.diff(S) <= 0).all())
+
+    def test_small_matrix(self):
+        """Matrices no larger than the random sample should still be decomposed exactly."""
+        A = _RNG.random((20, 8))
+        U, S, Vt = rsvd(A, 3)
+        U_full, S_full, Vt_full = np.linalg.svd(A, full_matrices=False)
+        self.assertTrue(np.allclose(S, S_full[:3]))
+        self.assertTrue(np.allclose(np.abs(Vt @ Vt_full[:3].T), np.eye(3)))
+
+
+class TestRandomArgmax(unittest.TestCase):
+
+    def test_unique_max(self):
+        """A unique maximum should always be selected."""
+        counts = np.array([[0, 5, 4, 1], [9, 0, 0, 8]])
+        for _ in range(20):
+            self.assertTrue((random_argmax(counts) == [1, 0]).all())
+
+    def test_ties_broken_randomly(self):
+        """Tied maxima should all be selected sometimes, and nothing else should."""
+        counts = np.tile([3, 0, 3, 3], (1000, 1))
+        self.assertEqual(set(random_argmax(counts)), {0, 2, 3})
+
+
+class TestAltMin(unittest.TestCase):
+
+    def test_separates_two_haplotypes(self):
+        """Reads drawn from two distinct haplotypes should be split between them."""
+        haps = np.array([[1, 2, 3, 4, 1, 2], [4, 3, 2, 1, 4, 3]])
+        M_E = np.repeat(haps, [6, 4], axis=0)
+        TM_E = np.concatenate([np.double(M_E == k) for k in range(1, 5)], axis=1)
+        P_matrix = np.double(M_E != 0)
+        Vt0 = np.concatenate([np.double(haps == k) for k in range(1, 5)], axis=1)
+        U, Vt = alt_min(TM_E, P_matrix, M_E, Vt0 + 0.1, ACGT_count(M_E), 100, 1e-5)
+        self.assertTrue((U.argmax(axis=1) == np.repeat([0, 1], [6, 4])).all())
+        self.assertTrue((Vt == Vt0).all())
+
+
+class TestAssignReads(unittest.TestCase):
+
+    def test_matches_per_read_loop(self):
+        """Should match the per-read loop the read assignment was originally written as."""
+        hap = _RNG.integers(1, 5, size=40)
+        M_E = np.tile(hap, (60, 1))
+        M_E[_RNG.random(M_E.shape) < 0.05] = _RNG.integers(1, 5)
+        M_E[_RNG.random(M_E.shape) < 0.3] = 0
+        mis_cri = _RNG.integers(1, 4, size=len(M_E))
+        seq_err = 0.01
+        ACGTcount = ACGT_count(M_E)
+        expected = []
+        for i in range(len(M_E)):
+            pos = np.where(M_E[i] != 0)[0]
+            hd = (M_E[i, pos] != hap[pos]).sum()
+            if hd == 0:
+                expected.append(i)
+            elif hd <= mis_cri[i]:
+                pr_variant = np.prod(
+                    ACGTcount[pos, M_E[i, pos] - 1] / ACGTcount[pos].sum(axis=1)
+                )
+                if binom.pmf(hd, len(pos), seq_err) > pr_variant:
+                    expected.append(i)
+        out = assign_reads(M_E, hap, ACGTcount, mis_cri, seq_err)
+        self.assertEqual(list(out), expected)
+
+
+class TestSuccessiveClustering(unittest.TestCase):
+
+    def test_recovers_two_haplotypes(self):
+        """Reads from two haplotypes at uneven frequencies should give back both."""
+        haps = np.array([[1, 2, 3, 4, 1, 2, 3, 4], [4, 3, 2, 1, 4, 3, 2, 1]])
+        SNVmatrix = np.repeat(haps, [30, 10], axis=0)
+        TM_E = np.concatenate(
+            [(SNVmatrix == k).astype(np.float32) for k in range(1, 5)], axis=1
+        )
+        P_matrix = (SNVmatrix != 0).astype(np.float32)
+        mis_cri = np.ones(len(SNVmatrix), dtype=int)
+        MEC, reconV2 = successive_clustering(
+            SNVmatrix, TM_E, P_matrix, mis_cri, ACGT_count(SNVmatrix), 2, 1, 0.002, 100, 1e-5
+        )
+        self.assertEqual(MEC, 0)
+        self.assertTrue((reconV2 == haps).all())
 
 
 if __name__ == "__main__":